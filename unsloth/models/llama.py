@@ -1553,9 +1553,11 @@ class LongRopeRotaryEmbedding(torch.nn.Module):
 pass
 
 
-def _wrap_fast_inference(generate, device_type, dtype, model):
+def _wrap_fast_inference(generate, device_type, dtype, model, use_inference_mode = True):
     # Wraps inference with bfloat16 / float16
-    @torch.inference_mode
+    # no_grad outputs can be used in training directly, unlike inference tensors
+    grad_context = torch.inference_mode if use_inference_mode else torch.no_grad
+    @grad_context()
     def _fast_generate(*args, **kwargs):
 
         if hasattr(model, "config") and hasattr(model.config, "max_position_embeddings"):
@@ -2625,7 +2627,7 @@ class FastLlamaModel:
 
 
     @staticmethod
-    def for_inference(model):
+    def for_inference(model, use_inference_mode = True):
         # if model.config.model_type == "qwen2":
         #     FastLlamaModel.for_training(model)
         #     return
@@ -2662,7 +2664,7 @@ class FastLlamaModel:
         # Wrap model.generate
         if model.generate.__name__ != "_fast_generate":
             model._unwrapped_old_generate = model.generate
-            model.generate = _wrap_fast_inference(model.generate, device_type, dtype, model)
+            model.generate = _wrap_fast_inference(model.generate, device_type, dtype, model, use_inference_mode)
         pass
 
         # Also disable training for embeddings for NEFTune
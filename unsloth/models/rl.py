@@ -20,11 +20,12 @@ __all__ = [
 import torch
 from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
 import inspect
+import hashlib
 import os
 import re
+import sys
 import torch
 from unsloth_zoo.compiler import create_new_function
-from unsloth_zoo.logging_utils import PatchRLStatistics
 from unsloth_zoo.rl_replacements import RL_REPLACEMENTS
 from .rl_replacements import (
     RL_EXTRA_ARGS,
@@ -33,8 +34,20 @@ from .rl_replacements import (
     RL_CONFIG_CHANGES,
     RL_METRICS_CHANGES,
 )
+from . import rl_replacements
 selective_log_softmax = RL_REPLACEMENTS["selective_log_softmax"]
 
+# Generated trainer sources are cached here, keyed by TRL and Unsloth sources
+RL_PATCH_CACHE_LOCATION = os.environ.get(
+    "UNSLOTH_RL_PATCH_CACHE_LOCATION",
+    os.path.join(os.path.expanduser("~"), ".cache", "unsloth", "rl_patches"),
+)
+# Sources generated or loaded in this session, so repeated PatchFastRL calls are free
+RL_PATCH_SOURCES = {}
+# PatchRLStatistics patches 1 shared progress callback, so remember the last
+# (trainer_file, other_metrics) it was called with across all trainers
+RL_PATCHED_STATISTICS = None
+
 torch_compile_options = {
     "epilogue_fusion"   : True,
     "max_autotune"      : False, # Disable Triton mm kernels
@@ -43,6 +56,58 @@ torch_compile_options = {
     "triton.cudagraphs" : False,
 }
 
+# Precompile all regexes used when patching every TRL trainer
+_RE_MULTIPLE_NEWLINES = re.compile(r"[\n]{3,}")
+_RE_INIT_DEF          = re.compile(r"def __init__\(.*?\).*?\:\n", flags = re.MULTILINE | re.DOTALL)
+_RE_VLLM_BLOCK        = re.compile(
+    r"(\n[\s]{8}"\
+    r"if (self|args)\.use_vllm\:.*?"\
+    r"\n[\s]{8}"\
+    "else:\n)",
+    flags = re.MULTILINE | re.DOTALL,
+)
+_RE_COMMENTS          = re.compile(r"\#[^\n]{1,}\n")
+_RE_SAMPLING_PARAMS   = re.compile(
+    r"\n[\s]{4,}(self\.[^\s]{1,}[\s]{0,}\=[\s]{0,}"\
+    r"SamplingParams\(.+?\))",
+    flags = re.MULTILINE | re.DOTALL,
+)
+_RE_MULTIPLE_COMMAS   = re.compile(r"[\,][\s]{0,}\,")
+# (el)if peft_config is (not) None: -> (el)if False: and get_peft_model(...) -> model
+_RE_PEFT_CONFIG       = re.compile(
+    r"(?P<peft_check>(?<=if )peft_config is (?:not )?None(?=\:))"\
+    r"|get_peft_model\(model, peft_config\)"
+)
+# All vLLM method rewrites in 1 pass. Lines are matched up to but not including
+# the final newline, so back to back lines can both be replaced.
+_RE_VLLM_METHOD       = re.compile(
+    # llm_model = self.llm.llm_engine.model_executor.driver_worker.model_runner.model
+    r"(?P<model_executor>\n[\s]{4,}).+?model_executor\.driver_worker.+?(?=\n)"\
+    # llm_model.load_weights(model.state_dict().items())
+    r"|(?P<load_weights>\n[\s]{4,}).+?load_weights\(.+?(?=\n)"\
+    # .state_dict()
+    r"|(?P<state_dict>\.state_dict\(\))"\
+    # self.llm.generate and self.llm.chat
+    r"|(?P<llm_call>self\.llm\.(?:generate|chat)\([^\)]{1,})\)"
+)
+
+# Default RLConfig overrides for GA / bsz and weight_decay
+RLConfig_replacements = {
+    "output_dir"                  : None,
+    "logging_nan_inf_filter"      : False,
+    "per_device_train_batch_size" : 4,
+    "gradient_accumulation_steps" : 2,
+    "weight_decay"                : 0.01,
+    "warmup_ratio"                : 0.1,
+    "seed"                        : 3407,
+    "optim"                       : "adamw_8bit",
+    "learning_rate"               : 5e-05,
+    "per_device_eval_batch_size"  : 4,
+    "eval_accumulation_steps"     : 2,
+    "torch_empty_cache_steps"     : 250,
+    "logging_steps"               : 1,
+}
+
 
 def vLLMSamplingParams(**kwargs):
     from vllm import SamplingParams
@@ -51,34 +116,174 @@ def vLLMSamplingParams(**kwargs):
     return sampling_params
 pass
 
+def unsloth_rl_trainer_pre_init(
+    args,
+    model,
+    local_variables,
+    check_precision    = False,
+    check_eval_dataset = False,
+    check_eval         = False,
+    check_model        = False,
+):
+    # Shared by every generated Unsloth RL trainer's __init__.
+    # Returns max_seq_length since the trainer's local variable might change.
+    max_seq_length = local_variables.get("max_seq_length", None)
+
+    # Edit bf16, fp16 by checking model's torch_dtype directly
+    if check_precision:
+        use_bf16 = getattr(args, "bf16", False)
+        use_fp16 = getattr(args, "fp16", False)
+        dtype = getattr(model.config, "torch_dtype", None)
+        if dtype is None: dtype = model.get_input_embeddings().dtype
+        from unsloth_zoo.utils import _get_dtype
+        dtype = _get_dtype(dtype)
+        float16 = dtype == torch.float16
+        if float16 and use_bf16:
+            raise TypeError("Unsloth: Model is in float16 precision but you want to use bfloat16 precision. Set fp16 to `True` and bf16 to `False`")
+        if not float16 and use_fp16:
+            raise TypeError("Unsloth: Model is in bfloat16 precision but you want to use float16 precision. Set fp16 to `False` and bf16 to `True`")
+        if not use_bf16 and not use_fp16:
+            args.fp16 = float16
+            args.bf16 = not float16
+            os.environ["ACCELERATE_MIXED_PRECISION"] = "fp16" if float16 else "bf16"
+    pass
+
+    # Check eval_dataset first
+    if check_eval_dataset:
+        if getattr(args, "eval_dataset", None) is not None and getattr(args, "eval_strategy", "no") == "no":
+            args.eval_strategy = "steps"
+            if getattr(args, "eval_steps", None) is None: args.eval_steps = 0.1
+    pass
+
+    if check_eval:
+        # Check if gradient accumulation bug fix is applied
+        ga_steps = getattr(args, "gradient_accumulation_steps", None)
+        if ga_steps is not None and ga_steps > 1:
+            from transformers import __version__ as transformers_version
+            from unsloth_zoo.utils import Version
+            if Version(transformers_version) <= Version("4.45.2"):
+                print("**** Unsloth: Please use our fixed gradient_accumulation_steps by updating transformers, TRL and Unsloth!\n"\
+                      "`pip install --upgrade --no-cache-dir --force-reinstall --no-deps unsloth transformers trl unsloth_zoo`")
+        pass
+
+        # Check if per_device_eval_batch_size (default 8) bigger than bsz
+        if getattr(args, "eval_strategy", "no") != "no":
+            eval_bsz = getattr(args, "per_device_eval_batch_size", 8)
+            if eval_bsz == 8 and args.per_device_train_batch_size < eval_bsz:
+                args.per_device_eval_batch_size = args.per_device_train_batch_size
+            if getattr(args, "eval_accumulation_steps", None) is None and ga_steps is not None:
+                args.eval_accumulation_steps = ga_steps
+        pass
+
+        # Also use FP16 / BF16 evaluation
+        fp16_full_eval = getattr(args, "fp16_full_eval", False)
+        bf16_full_eval = getattr(args, "bf16_full_eval", False)
+        if args.fp16 and bf16_full_eval: args.bf16_full_eval = False; args.fp16_full_eval = True
+        if args.bf16 and fp16_full_eval: args.bf16_full_eval = True; args.fp16_full_eval = False
+        if not bf16_full_eval and not fp16_full_eval:
+            args.bf16_full_eval = args.bf16
+            args.fp16_full_eval = args.fp16
+        pass
+    pass
+
+    if check_model:
+        # Check max_seq_length
+        if "max_seq_length" in local_variables or hasattr(args, "max_seq_length"):
+            model_max_seq_length = getattr(model, "max_seq_length", None)
+            args_max_seq_length  = getattr(args,  "max_seq_length", None)
+            if args_max_seq_length is None and model_max_seq_length is not None:
+                max_seq_length = model.max_seq_length
+                if hasattr(args, "max_seq_length"): args.max_seq_length = max_seq_length
+        pass
+
+        # Enable for training and move padding side of tokenizer to right
+        if model is not None and hasattr(model, "for_training"):
+            model.for_training()
+        if "tokenizer" in local_variables:
+            tokenizer = local_variables["tokenizer"]
+            if hasattr(tokenizer, "padding_side"): tokenizer.padding_side = "right"
+        if "processing_class" in local_variables:
+            processing_class = local_variables["processing_class"]
+            if hasattr(processing_class, "padding_side"): processing_class.padding_side = "right"
+            if hasattr(processing_class, "tokenizer") and hasattr(processing_class.tokenizer, "padding_side"):
+                processing_class.tokenizer.padding_side = "right"
+        pass
+    pass
+    return max_seq_length
+pass
+
+
+def unsloth_rl_trainer_post_init(self, args, model):
+    # Check NEFTune
+    if hasattr(self, "neftune_hook_handle"):
+        self.neftune_hook_handle.remove()
+        if hasattr(self, "neftune_hook_handle"): del self.neftune_hook_handle
+    if getattr(args, "neftune_noise_alpha", None) is not None:
+        model.get_input_embeddings().neftune_noise_alpha = self.neftune_noise_alpha
+    pass
+pass
+
+
+def unsloth_patch_rl_statistics(trainer_file, other_metrics = None):
+    # Only re-patch if another trainer or other metrics were patched last
+    global RL_PATCHED_STATISTICS
+    if other_metrics is None: other_metrics = []
+    patched = (trainer_file, tuple(other_metrics))
+    if RL_PATCHED_STATISTICS == patched: return
+    from unsloth_zoo.logging_utils import PatchRLStatistics
+    PatchRLStatistics(trainer_file, other_metrics)
+    RL_PATCHED_STATISTICS = patched
+pass
+
+
 def PatchRL(FastLanguageModel):
 
     from trl.models.utils import unwrap_model_for_generation
     from contextlib import contextmanager
+    import threading
+    unwrap_lock = threading.Lock()
 
     @contextmanager
     def unsloth_unwrap_model_for_generation(model, *args, **kwargs):
         with unwrap_model_for_generation(model, *args, **kwargs) as unwrapped_model:
-            # Put the model in inference mode.
-            FastLanguageModel.for_inference(unwrapped_model)
-
-            # We must use .clone for Unsloth since we force inference_mode
-            # Rather we should have used no_grad
-            original_generate = unwrapped_model.generate
-            def generate_with_clone(*args, **kwargs):
-                out = original_generate(*args, **kwargs)
-                if isinstance(out, torch.Tensor):
-                    return out.clone()
-                return out
+            # Only the first caller switches to inference and wraps generate, and only
+            # the last one to leave restores it, so nested or concurrent rollouts
+            # never capture each other's wrappers.
+            with unwrap_lock:
+                depth = getattr(unwrapped_model, "_unsloth_generation_depth", 0)
+                if depth == 0:
+                    # Put the model in inference mode, but generate under no_grad so
+                    # completions can be used in training without a .clone
+                    FastLanguageModel.for_inference(unwrapped_model, use_inference_mode = False)
+
+                    # generate might still be wrapped in inference_mode if for_inference
+                    # was called before, so only clone inference tensors
+                    original_generate = unwrapped_model.generate
+                    def generate_with_clone(*args, **kwargs):
+                        out = original_generate(*args, **kwargs)
+                        if isinstance(out, torch.Tensor) and out.is_inference():
+                            return out.clone()
+                        return out
+                    pass
+                    unwrapped_model._unsloth_original_generate = original_generate
+                    unwrapped_model.generate = generate_with_clone
+                pass
+                unwrapped_model._unsloth_generation_depth = depth + 1
             pass
-            unwrapped_model.generate = generate_with_clone
 
             try:
                 yield unwrapped_model
             finally:
-                # Restore generate and return
-                unwrapped_model.generate = original_generate
-                FastLanguageModel.for_training(model)
+                with unwrap_lock:
+                    depth = unwrapped_model._unsloth_generation_depth - 1
+                    unwrapped_model._unsloth_generation_depth = depth
+                    if depth == 0:
+                        # Restore generate and return
+                        unwrapped_model.generate = unwrapped_model._unsloth_original_generate
+                        del unwrapped_model._unsloth_original_generate
+                        FastLanguageModel.for_training(model)
+                    pass
+                pass
             pass
         pass
     pass
@@ -88,11 +293,10 @@ def PatchRL(FastLanguageModel):
     trainers = [x for x in trainers if x.endswith("_trainer")]
     unwrap = "unwrap_model_for_generation"
     for trainer in trainers:
-        try: current_trainer = eval(f"trl.trainer.{trainer}")
+        try: current_trainer = getattr(trl.trainer, trainer)
         except: continue
         if hasattr(current_trainer, unwrap):
-            try: exec(f"trl.trainer.{trainer}.{unwrap} = unsloth_{unwrap}")
-            except: continue
+            setattr(current_trainer, unwrap, unsloth_unwrap_model_for_generation)
     pass
 pass
 
@@ -106,6 +310,11 @@ import torch
 import numpy as np
 from contextlib import nullcontext
 from torch.nn import functional as F
+from unsloth.models.rl import (
+    unsloth_rl_trainer_pre_init,
+    unsloth_rl_trainer_post_init,
+    unsloth_patch_rl_statistics,
+)
 torch_compile_options = {{
     "epilogue_fusion"   : True,
     "max_autotune"      : False,
@@ -157,67 +366,144 @@ class Unsloth{RLTrainer_name}(_Unsloth{RLTrainer_name}):
 pass
 '''
 
-def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
-    # Patch for vLLM and Unsloth PEFT
-    import trl
-    import trl.trainer
+def get_trl_rl_trainers(trl_trainer):
+    # Find all TRL trainer modules and their Trainer / Config classes in 1 pass
+    # trl.trainer is lazily loaded, so dir() lists submodules vars() does not.
+    rl_trainers = {}
+    for trainer_file in dir(trl_trainer):
+        if not (trainer_file.islower() and trainer_file.endswith("_trainer")): continue
+        try: trainer = getattr(trl_trainer, trainer_file)
+        except: continue
+
+        # Get SFTTrainer and SFTConfig names
+        prefix  = trainer_file.split("_")[0]
+        objects = vars(trainer)
+        name   = [x for x in objects if x.endswith("Trainer") and x != "Trainer" and prefix in x.lower()]
+        config = [x for x in objects if x.endswith("Config")  and x != "Config"  and prefix in x.lower()]
+        if len(name)   != 1: continue
+        if len(config) != 1: continue
+
+        RLTrainer_name, RLConfig_name = name[0], config[0]
+        rl_trainers[trainer_file] = (
+            trainer,
+            RLTrainer_name, objects[RLTrainer_name],
+            RLConfig_name,  objects[RLConfig_name],
+        )
+    pass
+    return rl_trainers
+pass
+
+
+def _get_rl_patch_cache_prefix():
+    # Hash every input shared by all generated trainers once per patch_trl_rl_trainers.
+    # RL_REPLACEMENTS is hashed by source since git installs keep the same version.
+    # Returns None if anything fails, which disables caching for all trainers.
     try:
-        trainer = eval(f"trl.trainer.{trainer_file}")
-    except Exception as error:
-        return
-    
-    # Get SFTTrainer and SFTConfig names
-    name   = [x for x in dir(trainer) if x.endswith("Trainer") and x != "Trainer" and trainer_file.split("_")[0] in x.lower()]
-    config = [x for x in dir(trainer) if x.endswith("Config")  and x != "Config"  and trainer_file.split("_")[0] in x.lower()]
-    if len(name)   != 1: return
-    if len(config) != 1: return
-
-    # Get SFTTrainer, SFTConfig
-    RLTrainer_name = name[0]
-    RLConfig_name  = config[0]
-    try: RLTrainer = eval(f"trl.trainer.{trainer_file}.{RLTrainer_name}")
-    except: return
-    try: RLConfig  = eval(f"trl.trainer.{trainer_file}.{RLConfig_name}" )
-    except: return
+        from importlib.metadata import version as importlib_version
+        key = [
+            importlib_version("trl"),
+            importlib_version("transformers"),
+            importlib_version("unsloth_zoo"),
+            inspect.getsource(sys.modules[__name__]),
+            inspect.getsource(rl_replacements),
+        ]
+        for name in sorted(RL_REPLACEMENTS.keys()):
+            key.append(inspect.getsource(RL_REPLACEMENTS[name]))
+        pass
+        return hashlib.sha256("\n".join(key).encode("utf-8")).hexdigest()
+    except:
+        return None
+pass
 
-    # Check name
-    if RLTrainer.__name__.startswith("Unsloth"): return
-    if RLConfig .__name__.startswith("Unsloth"): return
 
+def _get_rl_patch_cache_file(trainer_file, RLTrainer, RLConfig, cache_prefix):
+    # Key on every input of the generated source so any change busts the cache.
+    # Signatures include fields inherited from transformers' TrainingArguments.
+    # Returns None if anything fails, which disables caching for this trainer.
+    if cache_prefix is None: return None
+    try:
+        key = [
+            cache_prefix,
+            trainer_file,
+            inspect.getsource(RLTrainer),
+            inspect.getsource(RLConfig),
+            str(inspect.signature(RLTrainer.__init__)),
+            str(inspect.signature(RLConfig .__init__)),
+        ]
+        key += RL_PRE_ITEMS.get(trainer_file, [])
+        key = hashlib.sha256("\n".join(key).encode("utf-8")).hexdigest()
+    except:
+        return None
+    return os.path.join(RL_PATCH_CACHE_LOCATION, f"{key}.py")
+pass
+
+
+def _load_rl_patch_cache(cache_file):
+    # Check this session's sources first, then the disk cache
+    if cache_file is None: return None
+    if cache_file in RL_PATCH_SOURCES: return RL_PATCH_SOURCES[cache_file]
+    try:
+        with open(cache_file, "r", encoding = "utf-8") as file:
+            RLTrainer_source = file.read()
+    except:
+        return None
+    RL_PATCH_SOURCES[cache_file] = RLTrainer_source
+    return RLTrainer_source
+pass
+
+
+def _save_rl_patch_cache(cache_file, RLTrainer_source):
+    if cache_file is None: return
+    RL_PATCH_SOURCES[cache_file] = RLTrainer_source
+    # Write to a temporary file first so partially written files are never read
+    temporary_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(RL_PATCH_CACHE_LOCATION, exist_ok = True)
+        with open(temporary_file, "w", encoding = "utf-8") as file:
+            file.write(RLTrainer_source)
+        os.replace(temporary_file, cache_file)
+    except:
+        # Do not leave partially written files behind
+        try: os.remove(temporary_file)
+        except: pass
+    pass
+pass
+
+
+def _create_rl_trainer_source(
+    trainer_file, RLTrainer_name, RLTrainer, RLConfig_name, RLConfig, all_imports, imports,
+):
     # Get old source
     old_RLTrainer_source = inspect.getsource(RLTrainer)
     old_RLConfig_source  = inspect.getsource(RLConfig)
 
-    all_imports = dir(trainer)
-    # Fix _deprecate_arguments not getting imported so stop __ but not _
-    imports = [x for x in all_imports if not x.startswith("__")]
-
     # Get default arguments
     EMPTY = inspect.Parameter.empty
     processed = []
     for RLobject in [RLTrainer, RLConfig]:
         parameters = inspect.signature(RLobject.__init__).parameters
         types = (bool, type(None), int, float, str,)
-        arguments = ["self"]
+        # Keep arguments as {name : argument} so defaults can be edited by name
+        arguments = {"self" : "self"}
         call_args = []
         for k, v in parameters.items():
             if k == "self": continue
             v = v.default
             if v == "\n": v = re.escape("\n")
-            if v is EMPTY: arguments.append(k)
-            elif type(v) is str:   arguments.append(f"{k} = '{v}'")
-            elif type(v) in types: arguments.append(f"{k} = {v}")
+            if v is EMPTY: arguments[k] = k
+            elif type(v) is str:   arguments[k] = f"{k} = '{v}'"
+            elif type(v) in types: arguments[k] = f"{k} = {v}"
             else: continue
             call_args.append(f"{k} = {k}")
         pass
-        arguments = f"\n{' '*8}" + f",\n{' '*8}".join(arguments)
         call_args = f"\n{' '*12}" + f",\n{' '*12}".join(call_args)
         processed.append((arguments, call_args,))
     pass
 
     # Process RLTrainer first
     arguments, call_args = processed[0]
-    RLTrainer_post = ""
+    arguments = f"\n{' '*8}" + f",\n{' '*8}".join(arguments.values())
+    RLTrainer_post = []
 
     # Add tokenizer if not seen
     if "tokenizer" not in parameters and "processing_class" in parameters:
@@ -228,104 +514,31 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         )
     pass
 
-    # Edit bf16, fp16 by checking model's torch_dtype directly
-    extra_args = ""
-    if "args" in call_args and "model" in call_args:
-        mixed_precision = \
-        "use_bf16 = getattr(args, 'bf16', False)\n"\
-        "use_fp16 = getattr(args, 'fp16', False)\n"\
-        "dtype = getattr(model.config, 'torch_dtype', None)\n"\
-        "if dtype is None: dtype = model.get_input_embeddings().dtype\n"\
-        "from unsloth_zoo.utils import _get_dtype\n"\
-        "dtype = _get_dtype(dtype)\n"\
-        "float16 = dtype == torch.float16\n"\
-        "if float16 and use_bf16: raise TypeError('Unsloth: Model is in float16 precision but you want to use bfloat16 precision. Set fp16 to `True` and bf16 to `False`')\n"\
-        "if not float16 and use_fp16: raise TypeError('Unsloth: Model is in bfloat16 precision but you want to use float16 precision. Set fp16 to `False` and bf16 to `True`')\n"\
-        "if not use_bf16 and not use_fp16:\n"\
-        "    args.fp16 = float16\n"\
-        "    args.bf16 = not float16\n"\
-        "    os.environ['ACCELERATE_MIXED_PRECISION'] = 'fp16' if float16 else 'bf16'\n"
-        extra_args += mixed_precision
-    pass
-
-    # Check if per_device_eval_batch_size (default 8) bigger than bsz
-    # Also use FP16 / BF16 evaluation
-    if "args" in call_args:
-        # Check eval_dataset first
-        if "eval_dataset" in call_args:
-            check_eval_dataset = \
-            "if getattr(args, 'eval_dataset', None) is not None and "\
-            "getattr(args, 'eval_strategy', 'no') == 'no':\n"\
-            "    args.eval_strategy = 'steps'\n"\
-            "    if getattr(args, 'eval_steps', None) is None: args.eval_steps = 0.1\n"
-            extra_args += check_eval_dataset
-        pass
-
-        # Check if gradient accumulation bug fix is applied
-        check_ga = \
-        "ga_steps = getattr(args, 'gradient_accumulation_steps', None)\n"\
-        "if ga_steps is not None and ga_steps > 1:\n"\
-        "    from transformers import __version__ as transformers_version\n"\
-        "    if Version(transformers_version) <= Version('4.45.2'):\n"\
-        "        print('**** Unsloth: Please use our fixed gradient_accumulation_steps by updating transformers, TRL and Unsloth!\\n'\n"\
-        "              '`pip install --upgrade --no-cache-dir --force-reinstall --no-deps unsloth transformers trl unsloth_zoo`')\n"
-        extra_args += check_ga
-
-        eval_changes = \
-        "if getattr(args, 'eval_strategy', 'no') != 'no':\n"\
-        "    eval_bsz = getattr(args, 'per_device_eval_batch_size', 8)\n"\
-        "    if eval_bsz == 8 and args.per_device_train_batch_size < eval_bsz: args.per_device_eval_batch_size = args.per_device_train_batch_size\n"\
-        "    if getattr(args, 'eval_accumulation_steps', None) is None and ga_steps is not None: args.eval_accumulation_steps = ga_steps\n"\
-        "fp16_full_eval = getattr(args, 'fp16_full_eval', False)\n"\
-        "bf16_full_eval = getattr(args, 'bf16_full_eval', False)\n"\
-        "if args.fp16 and bf16_full_eval: args.bf16_full_eval = False; args.fp16_full_eval = True\n"\
-        "if args.bf16 and fp16_full_eval: args.bf16_full_eval = True; args.fp16_full_eval = False\n"\
-        "if not bf16_full_eval and not fp16_full_eval: args.bf16_full_eval = args.bf16; args.fp16_full_eval = args.fp16\n"
-        extra_args += eval_changes
-    pass
-
-    # Check max_seq_length
-    if "model" in call_args:
-        length_check = \
-        "if 'max_seq_length' not in locals() and not hasattr(args, 'max_seq_length'):\n"\
-        "    pass\n"\
-        "else:\n"\
-        "    model_max_seq_length = getattr(model, 'max_seq_length', None)\n"\
-        "    args_max_seq_length  = getattr(args,  'max_seq_length', None)\n"\
-        "    if args_max_seq_length is None and model_max_seq_length is not None:\n"\
-        "        max_seq_length = model.max_seq_length\n"\
-        "        if hasattr(args, 'max_seq_length'): args.max_seq_length = max_seq_length\n"
-        "    elif args_max_seq_length is not None and model_max_seq_length is not None:\n"\
-        "        if args_max_seq_length > model_max_seq_length:\n"\
-        "            print('Unsloth: You set `max_seq_length` as ' + str(args_max_seq_length) + ' but \n"\
-        "                   the maximum the model supports is ' + str(model_max_seq_length) + '. We shall reduce it.')\n"\
-        "            args.max_seq_length = model_max_seq_length\n"
-        extra_args += length_check
-    pass
-
-    # Enable for training and move padding side of tokenizer to right
-    if "model" in call_args:
-        training_check = \
-        "if model is not None and hasattr(model, 'for_training'):\n"\
-        "    model.for_training()\n"\
-        "if 'tokenizer' in locals() and hasattr(tokenizer, 'padding_side'): tokenizer.padding_side = 'right'\n"\
-        "if 'processing_class' in locals():\n"\
-        "    if hasattr(processing_class, 'padding_side'): processing_class.padding_side = 'right'\n"\
-        "    if hasattr(processing_class, 'tokenizer') and hasattr(processing_class.tokenizer, 'padding_side'): "\
-        "processing_class.tokenizer.padding_side = 'right'\n"
-        extra_args += training_check
+    # Shared checks live in unsloth_rl_trainer_pre_init, so only the call is generated
+    extra_args = []
+    if "args" in call_args or "model" in call_args:
+        pre_init_checks = []
+        # Edit bf16, fp16 by checking model's torch_dtype directly
+        if "args" in call_args and "model" in call_args: pre_init_checks.append("check_precision")
+        # Check if per_device_eval_batch_size (default 8) bigger than bsz
+        # Also use FP16 / BF16 evaluation
+        if "args" in call_args and "eval_dataset" in call_args: pre_init_checks.append("check_eval_dataset")
+        if "args" in call_args: pre_init_checks.append("check_eval")
+        # Check max_seq_length, enable for training and move padding side to right
+        if "model" in call_args: pre_init_checks.append("check_model")
+
+        pre_init = \
+            "unsloth_rl_trainer_pre_init(args, " + \
+            ("model" if "model" in call_args else "None") + ", locals(), " + \
+            ", ".join(f"{check} = True" for check in pre_init_checks) + ")\n"
+        # The trainer's own max_seq_length might be changed to the model's
+        if "max_seq_length" in call_args: pre_init = "max_seq_length = " + pre_init
+        extra_args.append(pre_init)
     pass
 
     # Check NEFTune
     if "model" in call_args:
-        neftune_check = \
-        "if hasattr(self, 'neftune_hook_handle'):\n"\
-        "    self.neftune_hook_handle.remove()\n"\
-        "    if hasattr(self, 'neftune_hook_handle'): del self.neftune_hook_handle\n"\
-        "if getattr(args, 'neftune_noise_alpha', None) is not None:\n"\
-        "    model.get_input_embeddings().neftune_noise_alpha = self.neftune_noise_alpha\n"\
-        "pass\n"
-        RLTrainer_post += neftune_check
+        RLTrainer_post.append("unsloth_rl_trainer_post_init(self, args, model)\n")
     pass
 
     # Edit optional metrics
@@ -333,27 +546,27 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
     if trainer_file in RL_METRICS_CHANGES:
         process_extra_args = RL_METRICS_CHANGES[trainer_file]
         for process_extra_arg in process_extra_args:
-            other_metrics_processor += process_extra_arg(call_args, extra_args)
+            other_metrics_processor += process_extra_arg(call_args, "".join(extra_args))
     pass
 
     # Add statistics as well!
-    extra_args += \
+    extra_args.append(
         "other_metrics = []\n"\
         f"{other_metrics_processor}\n"\
-        "from unsloth_zoo.logging_utils import PatchRLStatistics\n"\
-        f"PatchRLStatistics('{trainer_file}', other_metrics)\n"
+        f"unsloth_patch_rl_statistics('{trainer_file}', other_metrics)\n"
+    )
 
     # Patch optional args
     if trainer_file in RL_EXTRA_ARGS:
         process_extra_args = RL_EXTRA_ARGS[trainer_file]
         for process_extra_arg in process_extra_args:
-            extra_args += process_extra_arg(call_args, extra_args)
+            extra_args.append(process_extra_arg(call_args, "".join(extra_args)))
     pass
 
-    # Create RLTrainer args
-    extra_args = extra_args.split("\n")
+    # Create RLTrainer args - join once to avoid quadratic string concatenation
+    extra_args = "".join(extra_args).split("\n")
     extra_args = "\n".join(" "*8 + x for x in extra_args)
-    RLTrainer_post = RLTrainer_post.split("\n")
+    RLTrainer_post = "".join(RLTrainer_post).split("\n")
     RLTrainer_post = "\n".join(" "*8 + x for x in RLTrainer_post)
     RLTrainer_arguments  = arguments
     RLTrainer_extra_args = extra_args
@@ -361,30 +574,15 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
 
     # Fix RLConfig next
     arguments, call_args = processed[1]
-    extra_args = ""
+    extra_args = []
 
     # Edit GA / bsz and weight_decay
-    replacements = {
-        "output_dir"                  : None,
-        "logging_nan_inf_filter"      : False,
-        "per_device_train_batch_size" : 4,
-        "gradient_accumulation_steps" : 2,
-        "weight_decay"                : 0.01,
-        "warmup_ratio"                : 0.1,
-        "seed"                        : 3407,
-        "optim"                       : "adamw_8bit",
-        "learning_rate"               : 5e-05,
-        "per_device_eval_batch_size"  : 4,
-        "eval_accumulation_steps"     : 2,
-        "torch_empty_cache_steps"     : 250,
-        "logging_steps"               : 1,
-    }
-    for k, v in replacements.items():
-        x = f"{k}( = [^,\n]{{1,}})?,\n"
+    for k, v in RLConfig_replacements.items():
+        if k not in arguments: continue
         y = f"'{v}'" if type(v) is str else f"{v}"
-        y = f"{k} = {y},\n"
-        arguments = re.sub(x, y, arguments)
+        arguments[k] = f"{k} = {y}"
     pass
+    arguments = f"\n{' '*8}" + f",\n{' '*8}".join(arguments.values())
 
     # Warn on too large or too small learning rate
     if " learning_rate" in call_args:
@@ -393,7 +591,7 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         "Consider increasing it, otherwise gradient updates will be close to 0!')\n"\
         "if learning_rate > 1: raise OverflowError(f'Unsloth: Your learning rate of `{learning_rate}` is way too larger > 1! "\
         "Consider decreasing it to 1e-1, otherwise gradient updates will explode!')\n"
-        extra_args += learning_rate_check
+        extra_args.append(learning_rate_check)
     pass
 
     # Add output_dir saving
@@ -403,7 +601,7 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         "if output_dir is None and save_strategy == 'steps' and save_steps == 500:\n"\
         "    output_dir = 'unsloth_training_checkpoints'\n"\
         "    save_strategy = 'no'\n"
-        extra_args += saving_check
+        extra_args.append(saving_check)
     pass
 
     # Edit dataset_num_proc
@@ -412,20 +610,20 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         "if dataset_num_proc is None:\n"\
         "    from multiprocessing import cpu_count\n"\
         "    dataset_num_proc = cpu_count()\n"
-        extra_args += num_proc_check
+        extra_args.append(num_proc_check)
     pass
 
     # Edit config with anything extra
     if trainer_file in RL_CONFIG_CHANGES:
         process_extra_args = RL_CONFIG_CHANGES[trainer_file]
         for process_extra_arg in process_extra_args:
-            extra_args += process_extra_arg(old_RLTrainer_source, old_RLConfig_source)
+            extra_args.append(process_extra_arg(old_RLTrainer_source, old_RLConfig_source))
     pass
 
     # Edit report_to and default it to nothing if max_steps is like 60
 
     # Create RLConfig args
-    extra_args = extra_args.split("\n")
+    extra_args = "".join(extra_args).split("\n")
     extra_args = "\n".join(" "*8 + x for x in extra_args)
     RLConfig_arguments  = arguments
     RLConfig_extra_args = extra_args
@@ -437,10 +635,9 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         RLTrainer_extras = f"_Unsloth{RLTrainer_name} = {RLTrainer_name}"
 
     # Create full module
-    exec(f"from trl.trainer import ({RLTrainer_name}, {RLConfig_name},)")
-    __RLTrainer_doc__ = eval(f"trl.trainer.{RLTrainer_name}").__doc__
+    __RLTrainer_doc__ = RLTrainer.__doc__
     if __RLTrainer_doc__ is None: __RLTrainer_doc__ = ""
-    __RLConfig_doc__  = eval(f"trl.trainer.{RLConfig_name}") .__doc__
+    __RLConfig_doc__  = RLConfig .__doc__
     if __RLConfig_doc__ is None: __RLConfig_doc__ = ""
 
     # Get all pre-modules
@@ -487,8 +684,38 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
     pass
 
     # Remove multiple newlines
-    RLTrainer_source = re.sub(r"[\n]{3,}", "\n", RLTrainer_source)
+    RLTrainer_source = _RE_MULTIPLE_NEWLINES.sub("\n", RLTrainer_source)
+    return RLTrainer_source
+pass
+
+
+def _prepare_trl_rl_trainer(
+    trainer_file, trainer, RLTrainer_name, RLTrainer, RLConfig_name, RLConfig, cache_prefix = None,
+):
+    # Only generates source code - patching TRL is done in _patch_trl_rl_trainers
+    # Check name
+    if RLTrainer.__name__.startswith("Unsloth"): return None
+    if RLConfig .__name__.startswith("Unsloth"): return None
+
+    all_imports = dir(trainer)
+    # Fix _deprecate_arguments not getting imported so stop __ but not _
+    imports = [x for x in all_imports if not x.startswith("__")]
+
+    # Reuse the generated source from a previous run if nothing changed
+    cache_file = _get_rl_patch_cache_file(trainer_file, RLTrainer, RLConfig, cache_prefix)
+    RLTrainer_source = _load_rl_patch_cache(cache_file)
+    if RLTrainer_source is None:
+        RLTrainer_source = _create_rl_trainer_source(
+            trainer_file, RLTrainer_name, RLTrainer, RLConfig_name, RLConfig, all_imports, imports,
+        )
+        _save_rl_patch_cache(cache_file, RLTrainer_source)
+    pass
+    return RLTrainer_source, imports
+pass
+
 
+def _patch_trl_rl_trainers(trl, trainer_file, trainer, RLTrainer_name, RLConfig_name, RLTrainer_source, imports):
+    # Patch for vLLM and Unsloth PEFT
     # Create new function
     created_module = create_new_function(
         f"Unsloth{RLTrainer_name}",
@@ -498,15 +725,13 @@ def _patch_trl_rl_trainers(trainer_file = "grpo_trainer"):
         overwrite = True,
     )
     
-    # Patch Trainer
-    exec(f"trl.{RLTrainer_name} = created_module.Unsloth{RLTrainer_name}", locals(), globals())
-    exec(f"trl.trainer.{RLTrainer_name} = created_module.Unsloth{RLTrainer_name}", locals(), globals())
-    exec(f"trl.trainer.{trainer_file}.{RLTrainer_name} = created_module.Unsloth{RLTrainer_name}", locals(), globals())
-    
-    # Patch Config
-    exec(f"trl.{RLConfig_name} = created_module.Unsloth{RLConfig_name}", locals(), globals())
-    exec(f"trl.trainer.{RLConfig_name} = created_module.Unsloth{RLConfig_name}", locals(), globals())
-    exec(f"trl.trainer.{trainer_file}.{RLConfig_name} = created_module.Unsloth{RLConfig_name}", locals(), globals())
+    # Patch Trainer and Config
+    created_trainer = getattr(created_module, f"Unsloth{RLTrainer_name}")
+    created_config  = getattr(created_module, f"Unsloth{RLConfig_name}")
+    for module in (trl, trl.trainer, trainer):
+        setattr(module, RLTrainer_name, created_trainer)
+        setattr(module, RLConfig_name,  created_config)
+    pass
 pass
 
 
@@ -515,20 +740,20 @@ def patch_functions(RLTrainer, trainer_file, RLTrainer_name, all_imports, import
     old_init = init
 
     # Remove peft_config
-    init = init.replace("elif peft_config is None:", "elif False:")
-    init = init.replace("elif peft_config is not None:", "elif False:")
-    init = init.replace("if peft_config is None:", "if False:")
-    init = init.replace("if peft_config is not None:", "if False:")
-    init = init.replace("get_peft_model(model, peft_config)", "model")
+    init = _RE_PEFT_CONFIG.sub(
+        lambda match: "False" if match.group("peft_check") is not None else "model",
+        init,
+    )
+
+    # Trainers without vLLM (DPO, KTO etc) skip all vLLM regexes below
+    RLTrainer_source = inspect.getsource(RLTrainer)
+    has_vllm_init = "use_vllm" in init
+    has_vllm = has_vllm_init or "vllm" in RLTrainer_source
 
     # Set use_vllm if not set
     if "args.use_vllm" in init and "model" in init and "args" in init:
         # .*? matches first match. .+? matches final match.
-        replacer = re.findall(
-            "def __init__\(.*?\).*?\:\n",
-            init,
-            flags = re.MULTILINE | re.DOTALL,
-        )
+        replacer = _RE_INIT_DEF.findall(init)
         if len(replacer) != 0:
             replacer = replacer[0]
             vllm_setter = "\n" + " "*8 + \
@@ -539,26 +764,14 @@ def patch_functions(RLTrainer, trainer_file, RLTrainer_name, all_imports, import
         pass
     pass
 
-    vllm_part = re.findall(
-        r"(\n[\s]{8}"\
-        r"if (self|args)\.use_vllm\:.*?"\
-        r"\n[\s]{8}"\
-        "else:\n)",
-        init,
-        flags = re.MULTILINE | re.DOTALL,
-    )
+    vllm_part = _RE_VLLM_BLOCK.findall(init) if has_vllm_init else []
     if len(vllm_part) == 1:
         vllm_part, args = vllm_part[0][0], vllm_part[0][1]
         # Strip all comments
-        new_vllm_part = re.sub(r"\#[^\n]{1,}\n", "", vllm_part)
+        new_vllm_part = _RE_COMMENTS.sub("", vllm_part)
 
         # Get SamplingParams
-        sampling_params = re.findall(
-            r"\n[\s]{4,}(self\.[^\s]{1,}[\s]{0,}\=[\s]{0,}"\
-            r"SamplingParams\(.+?\))",
-            new_vllm_part,
-            flags = re.MULTILINE | re.DOTALL,
-        )
+        sampling_params = _RE_SAMPLING_PARAMS.findall(new_vllm_part)
         if len(sampling_params) == 1:
             sampling_params = sampling_params[0]
 
@@ -580,7 +793,7 @@ def patch_functions(RLTrainer, trainer_file, RLTrainer_name, all_imports, import
             to_replace = "," + extra + "," + ")"
             sampling_params = to_replace.join(sampling_params.rsplit(")", 1))
             # Strip multiple commas
-            sampling_params = re.sub(r"[\,][\s]{0,}\,", ",", sampling_params)
+            sampling_params = _RE_MULTIPLE_COMMAS.sub(",", sampling_params)
 
             new_vllm_part = \
                 f"\n{' '*8}if {args}.use_vllm:\n{sampling_params}"\
@@ -590,14 +803,29 @@ def patch_functions(RLTrainer, trainer_file, RLTrainer_name, all_imports, import
         pass
     pass
 
-    # Search for vLLM calling in all child functions
-    functions = dir(RLTrainer)
-    RLTrainer_source = inspect.getsource(RLTrainer)
-    functions = [x for x in functions if f"def {x}" in RLTrainer_source]
-
     changed = {"__init__" : (old_init, init,)}
     edit_functions = RL_FUNCTIONS.get(trainer_file, [])
 
+    # Remove vLLM weight loading and use our LoRA for self.llm.generate / chat
+    lora_request = f", lora_request = self.model.load_lora('{trainer_file}_lora_model', load_tensors = True))"
+    def rewrite_vllm_method(match):
+        if match.group("model_executor") is not None:
+            return "\n" + match.group("model_executor") + "pass"
+        elif match.group("load_weights") is not None:
+            return "\n" + match.group("load_weights") + "pass"
+        elif match.group("state_dict") is not None:
+            return ""
+        return match.group("llm_call") + lora_request
+    pass
+
+    # Search for vLLM calling in all child functions
+    if has_vllm or len(edit_functions) != 0:
+        functions = dir(RLTrainer)
+        functions = [x for x in functions if f"def {x}" in RLTrainer_source]
+    else:
+        functions = []
+    pass
+
     for function in functions:
         if not hasattr(RLTrainer, function): continue
         fx = getattr(RLTrainer, function)
@@ -610,34 +838,8 @@ def patch_functions(RLTrainer, trainer_file, RLTrainer_name, all_imports, import
             source = edit_function(function, source)
         pass
 
-        # llm_model = self.llm.llm_engine.model_executor.driver_worker.model_runner.model
-        source = re.sub(
-            r"(\n[\s]{4,}).+?model_executor\.driver_worker.+?\n",
-            r"\n\1pass\n",
-            source,
-        )
-
-        # llm_model.load_weights(model.state_dict().items())
-        source = re.sub(
-            r"(\n[\s]{4,}).+?load_weights\(.+?\n",
-            r"\n\1pass\n",
-            source,
-        )
-
-        # .state_dict()
-        source = re.sub(
-            r"\.state_dict\(\)",
-            r"",
-            source,
-        )
-        
-        # Replace self.llm.generate and self.llm.chat
-        lora_name = trainer_file + "_lora_model"
-        source = re.sub(
-            r"(self\.llm\.(?:generate|chat)\([^\)]{1,})\)",
-            r"\1, lora_request = self.model.load_lora('" + lora_name + r"', load_tensors = True))",
-            source
-        )
+        # Remove vLLM weight loading and add LoRA to generate / chat in 1 pass
+        if has_vllm: source = _RE_VLLM_METHOD.sub(rewrite_vllm_method, source)
 
         # Skip if no changes done
         if source == original_source: continue
@@ -666,11 +868,18 @@ pass
 
 def patch_trl_rl_trainers():
     # Patch all TRL modules if they have vLLM or PEFT
+    # Import TRL once here and pass it down to every trainer
+    import trl
     import trl.trainer
-    all_trainers = dir(trl.trainer)
-    all_trainers = [x for x in all_trainers if x.islower() and x.endswith("_trainer")]
-    for trainer in all_trainers:
-        _patch_trl_rl_trainers(trainer)
+    rl_trainers = get_trl_rl_trainers(trl.trainer)
+    # Sources and versions shared by every trainer are only hashed once
+    cache_prefix = _get_rl_patch_cache_prefix()
+    for trainer_file, resolved in rl_trainers.items():
+        patch = _prepare_trl_rl_trainer(trainer_file, *resolved, cache_prefix = cache_prefix)
+        if patch is None: continue
+        trainer, RLTrainer_name, _, RLConfig_name, _ = resolved
+        _patch_trl_rl_trainers(trl, trainer_file, trainer, RLTrainer_name, RLConfig_name, *patch)
+    pass
     return
 pass
 
@@ -679,5 +888,5 @@ def PatchFastRL(algorithm = None, FastLanguageModel = None):
     if FastLanguageModel is not None: PatchRL(FastLanguageModel)
     patch_trl_rl_trainers()
     if type(algorithm) is str and algorithm.islower():
-        PatchRLStatistics(algorithm)
+        unsloth_patch_rl_statistics(algorithm)
 pass
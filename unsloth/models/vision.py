@@ -36,9 +36,11 @@ __all__ = [
     "FastBaseVisionModel",
 ]
 
-def _wrap_fast_inference(generate, device_type, dtype, model):
+def _wrap_fast_inference(generate, device_type, dtype, model, use_inference_mode = True):
     # Wraps inference with bfloat16 / float16
-    @torch.inference_mode
+    # no_grad outputs can be used in training directly, unlike inference tensors
+    grad_context = torch.inference_mode if use_inference_mode else torch.no_grad
+    @grad_context()
     def _fast_generate(*args, **kwargs):
         # For num_logits_to_keep
         # kwargs["num_logits_to_keep"] = 1
@@ -335,7 +337,7 @@ class FastBaseVisionModel:
 
 
     @staticmethod
-    def for_inference(model):
+    def for_inference(model, use_inference_mode = True):
         model.gradient_checkpointing = False
         model.training = False
 
@@ -356,7 +358,7 @@ class FastBaseVisionModel:
         # Wrap model.generate
         if model.generate.__name__ != "_fast_generate":
             model._unwrapped_old_generate = model.generate
-            model.generate = _wrap_fast_inference(model.generate, device_type, dtype, model)
+            model.generate = _wrap_fast_inference(model.generate, device_type, dtype, model, use_inference_mode)
         pass
         
         # Patch tokenizer to pad to the left
@@ -17,6 +17,7 @@ from transformers.convert_slow_tokenizer import convert_slow_tokenizer
 from transformers import PreTrainedTokenizerFast
 import re
 import os
+import math
 from transformers.models.llama.modeling_llama import logger
 from peft import PeftModelForCausalLM
 import torch
@@ -887,11 +888,13 @@ except:
             output (`torch.Tensor`):
                 The output tensor of the model (i.e. the embeddings).
         """
-        if module.training:
-            dims = torch.tensor(output.size(1) * output.size(2))
-            mag_norm = module.neftune_noise_alpha / torch.sqrt(dims)
-            output = output + torch.zeros_like(output).uniform_(-mag_norm, mag_norm)
-        return output
+        if not module.training: return output
+        # Sizes are Python ints, so mag_norm stays a Python float - no GPU sync
+        dims = output.size(1) * output.size(2)
+        mag_norm = module.neftune_noise_alpha / math.sqrt(dims)
+        # uniform_ fills in 1 kernel in output's dtype. Add out of place since
+        # enable_input_require_grads makes output a leaf requiring grad.
+        return output + torch.empty_like(output).uniform_(-mag_norm, mag_norm)
     pass
 pass
 